@@ -4,70 +4,93 @@ Google Gemini 2.5 Flash Image API를 활용하여 제품 이미지를 분석하
 """
 
 import os
+import re
+import asyncio
 import base64
+import collections
+import io
 import json
-from datetime import datetime
+import logging
+import orjson
+import functools
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, render_template, request, send_from_directory
 from flask_cors import CORS
+from flask_compress import Compress
 from werkzeug.utils import secure_filename
-import google.generativeai as genai
+from streaming_form_data import ParseFailedException, StreamingFormDataParser
+from streaming_form_data.targets import FileTarget
+from streaming_form_data.validators import MaxSizeValidator, ValidationError
 from google import genai as genai_client
 from google.genai import types
-from PIL import Image
-import io
+from google.genai import errors as genai_errors
+from tenacity import (
+    before_sleep_log, retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+)
+from PIL import Image, ImageOps
+import blake3
+import diskcache
 from dotenv import load_dotenv
 
+try:
+    # SIMD(SSSE3/AVX2) 가속 base64 인코딩
+    from pybase64 import b64decode, b64encode_as_string
+except ImportError:
+    from base64 import b64decode
+
+    def b64encode_as_string(data):
+        return base64.b64encode(data).decode('ascii')
+
 # .env 파일 로드
 load_dotenv()
 
+# 로깅 설정 (LOG_LEVEL=DEBUG로 상세 로그 활성화)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='[%(levelname)s] %(message)s')
+log = logging.getLogger(__name__)
+
 app = Flask(__name__)
 CORS(app)  # CORS 활성화
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['GENERATED_FOLDER'] = 'generated'
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'webp'}
+app.config['REFERENCE_FOLDER'] = os.path.join('uploads', 'reference')
+app.config['CACHE_FOLDER'] = '.cache'
+
+# 응답 압축 (HTML/JSON 등 텍스트만 대상, 기본 MIME 목록에 PNG 등 이미 압축된 이미지는 없음)
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+app.config['COMPRESS_BR_LEVEL'] = 4
+app.config['COMPRESS_MIN_SIZE'] = 1024
+Compress(app)
 
 # 폴더 생성
 Path(app.config['UPLOAD_FOLDER']).mkdir(exist_ok=True)
 Path(app.config['GENERATED_FOLDER']).mkdir(exist_ok=True)
+Path(app.config['REFERENCE_FOLDER']).mkdir(parents=True, exist_ok=True)
 
-# Google Gemini API 설정
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', '')
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
-
-
-def allowed_file(filename):
-    """허용된 파일 확장자 체크"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+# 업로드/생성 파일의 브라우저 캐시 유지 시간 (1년, 파일명이 고유하므로 변경되지 않음)
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
 
+# 업로드 요청 본문을 읽어 파서에 넘기는 단위
+UPLOAD_READ_CHUNK_SIZE = 64 * 1024
 
-def analyze_product_image(image_path):
-    """
-    Gemini API를 사용하여 제품 이미지 분석
-    """
-    if not GOOGLE_API_KEY:
-        error_msg = "GOOGLE_API_KEY가 설정되지 않았습니다."
-        print(f"[ERROR] {error_msg}")
-        raise ValueError(error_msg)
+# API 전송용 참조 이미지 최대 크기
+REFERENCE_MAX_SIZE = (1024, 1024)
+# EXIF 회전 정보(Orientation) 태그 번호
+EXIF_ORIENTATION_TAG = 0x0112
 
-    try:
-        # Gemini Pro Vision 모델 사용
-        print(f"[DEBUG] 분석 모델 초기화: gemini-2.5-flash-image")
-        model = genai.GenerativeModel('gemini-2.5-flash-image')
+# 응답에서 JSON 본문 추출 (마크다운 코드 블록 및 앞뒤 텍스트 무시)
+_JSON_FENCE = re.compile(r"(?:```(?:json)?\s*)?(\{.*\}|\[.*\])(?:\s*```)?", re.DOTALL)
 
-        # 이미지 로드
-        print(f"[DEBUG] 이미지 로드 중: {image_path}")
-        img = Image.open(image_path)
-        print(f"[DEBUG] 이미지 크기: {img.size}")
-    except Exception as e:
-        print(f"[ERROR] 이미지 로드 실패: {str(e)}")
-        raise
+# 프롬프트 생성에 사용하는 분석 결과 항목 (클라이언트가 보낸 분석 결과 검증용)
+ANALYSIS_TEXT_FIELDS = ('product_name', 'category', 'style', 'target_audience')
+ANALYSIS_LIST_FIELDS = ('key_features', 'use_cases')
 
-    # 이미지 분석 프롬프트
-    prompt = """
+# 제품 이미지 분석 요청 프롬프트
+_ANALYSIS_PROMPT = """
     이 제품 이미지를 자세히 분석해주세요.
 
     다음 정보를 JSON 형식으로 제공해주세요:
@@ -85,34 +108,370 @@ def analyze_product_image(image_path):
     응답은 반드시 유효한 JSON 형식으로만 작성해주세요.
     """
 
-    print(f"[DEBUG] 이미지 분석 API 호출 중...")
+# 분석 결과로 장면 프롬프트를 만드는 요청 템플릿 (str.format_map으로 채움)
+_SCENE_PROMPT_TMPL = """
+    다음 제품 정보를 바탕으로 블로그 리뷰용 이미지 생성을 위한 {num_images}개의 다양한 장면/시나리오를 만들어주세요.
+
+    제품 정보:
+    - 제품명: {product_name}
+    - 카테고리: {category}
+    - 특징: {features}
+    - 스타일: {style}
+    - 타겟 고객: {target_audience}
+    - 사용 사례: {use_cases}
+
+    요구사항:
+    1. 각 장면은 제품의 다른 측면이나 사용 상황을 보여줘야 합니다
+    2. 블로그 리뷰에 적합한 실용적인 장면들
+    3. 라이프스타일, 디테일 샷, 사용 장면, 패키징 등 다양하게 구성
+
+    JSON 형식으로 응답:
+    {{
+        "prompts": [
+            {{"title": "장면 제목", "description": "이미지 생성 프롬프트 (한글, 자세하고 구체적으로)"}},
+            ...
+        ]
+    }}
+    """
+
+# 분석 결과와 프롬프트의 디스크 캐시 (내용 해시 기준, 워커 프로세스 간 공유)
+# 최대 크기를 넘으면 가장 오래 사용하지 않은 항목부터 제거
+CACHE_SIZE_LIMIT = 100 * 1024 * 1024
+_cache = diskcache.Cache(
+    app.config['CACHE_FOLDER'],
+    size_limit=CACHE_SIZE_LIMIT,
+    eviction_policy='least-recently-used'
+)
+
+# 진행 중인 이미지 생성 작업 ((파일명, 개수) 기준, 중복 요청은 같은 작업을 공유)
+# 동시에 실행할 수 있는 생성 작업 수 (기본값: 워커당 스레드 수와 같게 하여 초과 작업이 대기하지 않도록 함)
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', os.getenv('GUNICORN_THREADS', 16)))
+_generation_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS)
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# 재시도 대상 HTTP 상태 코드 (요청 한도 초과, 서버 오류, 서비스 일시 불가, 시간 초과)
+RETRYABLE_STATUS_CODES = {429, 500, 503, 504}
+
+# 이미지 생성 동시 요청 수 제한
+IMAGE_GENERATION_CONCURRENCY = int(os.getenv('IMAGE_GENERATION_CONCURRENCY', 5))
+
+# 프로세스 전체(모든 요청 합계)의 이미지 생성 동시 요청 수와 분당 요청 수 제한
+# 분당 요청 수가 0이면 제한하지 않음
+IMAGE_GENERATION_MAX_INFLIGHT = int(os.getenv('IMAGE_GENERATION_MAX_INFLIGHT', 8))
+IMAGE_GENERATION_RPM = int(os.getenv('IMAGE_GENERATION_RPM', 0))
+
+# 장면 설명이 같은 프롬프트를 한 번의 요청(candidate_count)으로 묶어 생성 (기본값: 사용 안 함)
+# 묶음당 최대 이미지 수는 IMAGE_BATCH_MAX_SIZE
+IMAGE_GENERATION_BATCH = os.getenv('IMAGE_GENERATION_BATCH', '0') == '1'
+IMAGE_BATCH_MAX_SIZE = 4
+
+# 여러 이미지 요청이 참조 이미지를 공유하도록 컨텍스트 캐시 사용 (기본값: 사용)
+# 모델이 캐시를 지원하지 않는다는 응답(4xx)을 받으면 프로세스 내에서 다시 시도하지 않음
+IMAGE_CONTEXT_CACHE = os.getenv('IMAGE_CONTEXT_CACHE', '1') == '1'
+# 캐시 유지 시간(초). 재시도와 분당 요청 제한 대기로 생성이 길어져도 도중에 만료되지 않도록
+# 요청 제한 시간(GUNICORN_TIMEOUT)보다 짧게 두지 않음 (생성이 끝나면 바로 삭제)
+IMAGE_CONTEXT_CACHE_TTL = max(
+    int(os.getenv('IMAGE_CONTEXT_CACHE_TTL', 0)),
+    int(os.getenv('GUNICORN_TIMEOUT', 600))
+)
+_context_cache_supported = True
+
+# Google Gemini API 설정
+GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY', '')
+
+# 분석, 프롬프트 생성, 이미지 생성에 사용하는 모델
+# 캐시 키에도 포함되어 모델이 바뀌면 이전 분석/프롬프트 캐시를 사용하지 않음
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash-image')
+
+# 클라이언트는 프로세스당 한 번만 생성
+_CLIENT = genai_client.Client(api_key=GOOGLE_API_KEY) if GOOGLE_API_KEY else None
+
+# 클라이언트 API 호출 전용 이벤트 루프 (프로세스당 하나, 별도 스레드에서 계속 실행)
+# 클라이언트의 aiohttp 세션은 이벤트 루프에 묶이는데, async 뷰와 생성 작업은 요청마다
+# 새 이벤트 루프에서 실행되므로 API 호출만 이 루프로 보내 세션과 연결 풀을 요청 간에 재사용
+_client_loop = None
+_client_loop_lock = threading.Lock()
+
+
+def _get_client():
+    """
+    공유 Gemini 클라이언트 반환
+    아직 생성되지 않았으면 생성 (테스트 등에서 _CLIENT를 None으로 초기화하면 재생성)
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = genai_client.Client(api_key=GOOGLE_API_KEY)
+    return _CLIENT
+
+
+def _get_client_loop():
+    """클라이언트 전용 이벤트 루프 반환 (처음 호출될 때 스레드와 함께 생성, gunicorn 워커 fork 이후)"""
+    global _client_loop
+    with _client_loop_lock:
+        if _client_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='gemini-client-loop', daemon=True).start()
+            _client_loop = loop
+    return _client_loop
+
+
+async def _on_client_loop(coro):
+    """
+    클라이언트 API 코루틴을 전용 이벤트 루프에서 실행하고 결과를 기다림
+    기다리는 쪽이 취소되면 전용 루프의 작업도 함께 취소
+    """
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _get_client_loop()))
+
+
+def sniff_image_type(head):
+    """
+    파일 앞부분의 시그니처(매직 바이트)로 이미지 형식 판별
+    허용 형식(PNG, JPEG, WEBP)이 아니면 None 반환
+    """
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def _extract_json(text):
+    """응답 텍스트에서 JSON을 추출하여 파싱"""
+    # 코드 블록 없이 JSON만 온 경우 정규식 검색 없이 바로 파싱
+    if text[:1] in ('{', '['):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    match = _JSON_FENCE.search(text)
+    return orjson.loads(match.group(1) if match else text)
+
+
+def _json_response(payload, status=200):
+    """orjson으로 직렬화한 JSON 응답 생성 (jsonify 대체)"""
+    return app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
+
+
+def _prepare_reference(image_path):
+    """
+    API 전송용 참조 이미지 준비
+    긴 변을 1024px 이하로 축소한 JPEG를 (경로, 수정 시각) 기준으로 디스크와 메모리에 캐시하고
+    인코딩된 바이트 그대로 요청 파트로 반환 (호출마다 SDK가 다시 인코딩하지 않음)
+    """
+    mtime_ns = os.stat(image_path).st_mtime_ns
+    return _load_reference(str(image_path), mtime_ns)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_reference(image_path, mtime_ns):
+    """축소된 참조 이미지 로드 (캐시 파일이 없으면 생성)"""
+    cache_path = Path(app.config['REFERENCE_FOLDER']) / f"{Path(image_path).stem}_{mtime_ns}.jpg"
+
+    if not cache_path.exists():
+        img = Image.open(image_path)
+        # 이미 기준 크기 이하의 RGB JPEG면 다시 인코딩하지 않고 원본 바이트 그대로 사용
+        if _is_reference_ready(img):
+            return types.Part.from_bytes(data=Path(image_path).read_bytes(), mime_type='image/jpeg')
+
+        data = _encode_reference(img)
+        # 동시 요청이 미완성 파일을 읽지 않도록 임시 파일에 쓴 뒤 교체
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, cache_path)
+        return types.Part.from_bytes(data=data, mime_type='image/jpeg')
+
+    return types.Part.from_bytes(data=cache_path.read_bytes(), mime_type='image/jpeg')
+
+
+def _reference_from_bytes(data):
+    """메모리에 있는 이미지 바이트로 참조 이미지 준비 (디스크 캐시 없음)"""
+    img = Image.open(io.BytesIO(data))
+    if not _is_reference_ready(img):
+        data = _encode_reference(img)
+    return types.Part.from_bytes(data=data, mime_type='image/jpeg')
+
+
+def _is_reference_ready(img):
+    """다시 인코딩하지 않고 그대로 보낼 수 있는 이미지인지 (기준 크기 이하이고 회전 정보가 없는 RGB JPEG)"""
+    return (img.format == 'JPEG' and img.mode == 'RGB' and max(img.size) <= max(REFERENCE_MAX_SIZE)
+            and img.getexif().get(EXIF_ORIENTATION_TAG, 1) == 1)
+
+
+def _encode_reference(img):
+    """긴 변을 1024px 이하로 축소한 RGB JPEG 바이트로 변환"""
+    if img.format == 'JPEG':
+        # libjpeg이 DCT 단계에서 1/2~1/8 크기로 바로 디코딩하도록 요청
+        img.draft('RGB', REFERENCE_MAX_SIZE)
+    # 휴대폰 사진은 EXIF 회전 정보로 방향을 표시하므로 재인코딩 전에 픽셀에 반영
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail(REFERENCE_MAX_SIZE, Image.Resampling.LANCZOS)
+
+    # JPEG는 알파 채널이 없으므로 투명 영역을 흰 배경으로 합성
+    if img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, 'white')
+        background.paste(img, mask=img.getchannel('A'))
+        img = background
+    elif img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _save_generated(image_data, image_kind, filename):
+    """
+    생성 이미지를 WebP로 저장 (PNG 대비 용량 약 1/4)
+    이미 WebP면 디코딩/재인코딩 없이 그대로 기록
+    """
+    output_path = Path(app.config['GENERATED_FOLDER']) / filename
+    if image_kind == 'webp':
+        output_path.write_bytes(image_data)
+    else:
+        with Image.open(io.BytesIO(image_data)) as img:
+            img.save(output_path, 'WEBP', quality=90, method=4)
+
+
+def _is_retryable(exc):
+    """재시도할 일시적 오류인지 확인 (요청 한도 초과, 서버 오류, 시간 초과)"""
+    if isinstance(exc, TimeoutError):
+        return True
+    return isinstance(exc, genai_errors.APIError) and exc.code in RETRYABLE_STATUS_CODES
+
+
+# Gemini API 호출 재시도 정책 (지수 백오프 + 지터)
+# 함수 전체가 아니라 API 호출 단위로 적용하여 실패한 요청만 다시 보냄
+_api_retry = retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=wait_exponential_jitter(initial=2, max=30),
+    stop=stop_after_attempt(4),
+    before_sleep=before_sleep_log(log, logging.WARNING),
+    reraise=True
+)
+
+
+@_api_retry
+async def _generate_content(contents):
+    """텍스트 응답용 Gemini API 호출 (일시적 오류는 재시도)"""
+    return await _on_client_loop(_get_client().aio.models.generate_content(
+        model=GEMINI_MODEL,
+        contents=contents
+    ))
+
+
+def _validate_analysis(analysis):
+    """
+    분석 결과 검증 (모델 응답, 클라이언트가 보낸 값)
+    프롬프트 생성에 필요한 항목이 올바른 형식이면 그대로 반환하고, 아니면 None
+    """
+    if not isinstance(analysis, dict):
+        return None
+    for field in ANALYSIS_TEXT_FIELDS:
+        if not isinstance(analysis.get(field), str):
+            return None
+    for field in ANALYSIS_LIST_FIELDS:
+        items = analysis.get(field)
+        if not isinstance(items, list) or not all(isinstance(item, str) for item in items):
+            return None
+    return analysis
+
+
+def _validate_prompts(prompts):
+    """
+    장면 프롬프트 목록 검증
+    각 항목이 문자열 title/description을 가진 dict인 비어 있지 않은 목록이면 그대로 반환하고, 아니면 None
+    """
+    if not isinstance(prompts, list) or not prompts:
+        return None
+    for item in prompts:
+        if not isinstance(item, dict):
+            return None
+        if not isinstance(item.get('title'), str) or not isinstance(item.get('description'), str):
+            return None
+    return prompts
+
+
+def image_cache_key(image_path):
+    """
+    이미지 내용의 BLAKE3 해시 (분석 캐시 키)
+    파일 전체를 메모리로 읽지 않고 메모리 맵으로 해시 (GIL 해제)
+    """
+    return blake3.blake3().update_mmap(image_path).hexdigest()
+
+
+def analysis_cache_key(analysis):
+    """분석 결과를 키 순서와 무관하게 직렬화한 BLAKE3 해시 (프롬프트 캐시 키)"""
+    return blake3.blake3(orjson.dumps(analysis, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+async def analyze_product_image(image_path):
+    """
+    Gemini API를 사용하여 제품 이미지 분석
+    """
+    return await _analyze_image(image_cache_key(image_path), lambda: _prepare_reference(image_path))
+
+
+async def analyze_image_bytes(data):
+    """메모리에 있는 이미지 바이트를 디스크에 저장하지 않고 분석 (캐시 키는 파일과 동일)"""
+    return await _analyze_image(blake3.blake3(data).hexdigest(), lambda: _reference_from_bytes(data))
+
+
+async def _analyze_image(image_key, load_image):
+    """
+    이미지 분석 공통 처리
+    load_image는 캐시에 결과가 없을 때만 호출하여 API 전송용 이미지 파트를 준비
+    """
+    if not GOOGLE_API_KEY:
+        error_msg = "GOOGLE_API_KEY가 설정되지 않았습니다."
+        log.error("%s", error_msg)
+        raise ValueError(error_msg)
+
+    # 같은 이미지를 이미 분석했으면 캐시 결과 사용
+    cache_key = ('analysis', GEMINI_MODEL, image_key)
+    analysis = _validate_analysis(_cache.get(cache_key))
+    if analysis is not None:
+        log.debug("분석 결과 캐시 사용: %s", image_key)
+        return analysis
+
+    try:
+        # 이미지 로드
+        log.debug("이미지 로드 중: %s", image_key)
+        img = load_image()
+        log.debug("전송 이미지 크기: %s bytes", len(img.inline_data.data))
+    except Exception as e:
+        log.error("이미지 로드 실패: %s", e)
+        raise
+
+    log.debug("이미지 분석 API 호출 중...")
     try:
-        response = model.generate_content([prompt, img])
-        print(f"[DEBUG] 분석 응답 수신 완료")
+        response = await _generate_content([_ANALYSIS_PROMPT, img])
+        log.debug("분석 응답 수신 완료")
     except Exception as e:
-        print(f"[ERROR] 이미지 분석 API 호출 실패: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("이미지 분석 API 호출 실패: %s", e)
         raise
 
     # JSON 파싱
+    # 응답에서 JSON 추출 (마크다운 코드 블록 제거)
+    response_text = response.text or ''
+    log.debug("응답 텍스트 길이: %s", len(response_text))
     try:
-        # 응답에서 JSON 추출 (마크다운 코드 블록 제거)
-        response_text = response.text.strip()
-        print(f"[DEBUG] 응답 텍스트 길이: {len(response_text)}")
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]
-        if response_text.startswith('```'):
-            response_text = response_text[3:]
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]
-
-        analysis = json.loads(response_text.strip())
-        print(f"[DEBUG] JSON 파싱 성공")
+        analysis = _validate_analysis(_extract_json(response_text))
+        if analysis is None:
+            log.warning("분석 결과 형식이 올바르지 않아 기본값 사용")
     except json.JSONDecodeError as e:
-        # JSON 파싱 실패 시 기본값 반환
-        print(f"[WARNING] JSON 파싱 실패, 기본값 사용: {str(e)}")
-        print(f"[DEBUG] 원본 응답: {response.text[:500]}")
+        log.warning("JSON 파싱 실패, 기본값 사용: %s", e)
+        analysis = None
+
+    if analysis is not None:
+        log.debug("JSON 파싱 성공")
+        # 형식 검증까지 통과한 결과만 캐시 (기본값은 캐시하지 않음)
+        _cache.set(cache_key, analysis)
+    else:
+        log.debug("원본 응답: %.500s", response_text)
         analysis = {
             "product_name": "분석된 제품",
             "category": "일반 제품",
@@ -121,148 +480,249 @@ def analyze_product_image(image_path):
             "style": "모던",
             "target_audience": "일반 소비자",
             "use_cases": ["일상 사용", "선물용", "실용적 용도"],
-            "description": response.text[:200]
+            "description": response_text[:200]
         }
 
     return analysis
 
 
-def generate_image_prompts(analysis, num_images=10):
+def _iter_async(agen):
+    """비동기 제너레이터를 동기 제너레이터로 변환 (WSGI 스트리밍 응답용)"""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+async def generate_image_prompts(analysis, num_images=10):
     """
     제품 분석 결과를 바탕으로 다양한 이미지 생성 프롬프트 생성
+    (모델, 분석 결과 해시, num_images) 기준으로 결과를 캐시하므로
+    같은 분석 결과면 다른 이미지라도 캐시된 프롬프트를 재사용
     """
     if not GOOGLE_API_KEY:
         error_msg = "GOOGLE_API_KEY가 설정되지 않았습니다."
-        print(f"[ERROR] {error_msg}")
+        log.error("%s", error_msg)
         raise ValueError(error_msg)
 
-    print(f"[DEBUG] 프롬프트 생성 모델 초기화")
-    model = genai.GenerativeModel('gemini-2.5-flash-image')
+    analysis_key = analysis_cache_key(analysis)
+    cache_key = ('prompts', GEMINI_MODEL, analysis_key, num_images)
+    prompts = _validate_prompts(_cache.get(cache_key))
+    if prompts is not None:
+        log.debug("프롬프트 캐시 사용: %s", analysis_key)
+        return prompts
 
-    prompt = f"""
-    다음 제품 정보를 바탕으로 블로그 리뷰용 이미지 생성을 위한 {num_images}개의 다양한 장면/시나리오를 만들어주세요.
-
-    제품 정보:
-    - 제품명: {analysis['product_name']}
-    - 카테고리: {analysis['category']}
-    - 특징: {', '.join(analysis['key_features'])}
-    - 스타일: {analysis['style']}
-    - 타겟 고객: {analysis['target_audience']}
-    - 사용 사례: {', '.join(analysis['use_cases'])}
+    features = ', '.join(analysis['key_features'])
+    use_cases = ', '.join(analysis['use_cases'])
 
-    요구사항:
-    1. 각 장면은 제품의 다른 측면이나 사용 상황을 보여줘야 합니다
-    2. 블로그 리뷰에 적합한 실용적인 장면들
-    3. 라이프스타일, 디테일 샷, 사용 장면, 패키징 등 다양하게 구성
-
-    JSON 형식으로 응답:
-    {{
-        "prompts": [
-            {{"title": "장면 제목", "description": "이미지 생성 프롬프트 (한글, 자세하고 구체적으로)"}},
-            ...
-        ]
-    }}
-    """
+    prompt = _SCENE_PROMPT_TMPL.format_map(
+        dict(analysis, features=features, use_cases=use_cases, num_images=num_images)
+    )
 
-    print(f"[DEBUG] 프롬프트 생성 API 호출 중...")
+    log.debug("프롬프트 생성 API 호출 중...")
     try:
-        response = model.generate_content(prompt)
-        print(f"[DEBUG] 프롬프트 생성 응답 수신 완료")
+        response = await _generate_content(prompt)
+        log.debug("프롬프트 생성 응답 수신 완료")
     except Exception as e:
-        print(f"[ERROR] 프롬프트 생성 API 호출 실패: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log.exception("프롬프트 생성 API 호출 실패: %s", e)
         raise
 
     try:
-        response_text = response.text.strip()
-        if response_text.startswith('```json'):
-            response_text = response_text[7:]
-        if response_text.startswith('```'):
-            response_text = response_text[3:]
-        if response_text.endswith('```'):
-            response_text = response_text[:-3]
-
-        prompts_data = json.loads(response_text.strip())
-        print(f"[DEBUG] 프롬프트 JSON 파싱 성공 - {len(prompts_data['prompts'])}개 생성")
-        return prompts_data['prompts'][:num_images]
-    except (json.JSONDecodeError, KeyError) as e:
-        # 기본 프롬프트 생성
-        print(f"[WARNING] 프롬프트 JSON 파싱 실패, 기본 프롬프트 사용: {str(e)}")
-        return [
-            {"title": f"제품 사용 장면 {i+1}", "description": f"{analysis['product_name']}을(를) 사용하는 모습"}
-            for i in range(num_images)
-        ]
+        prompts_data = _extract_json(response.text or '')
+        prompts = _validate_prompts(prompts_data.get('prompts') if isinstance(prompts_data, dict) else None)
+        if prompts is not None:
+            log.debug("프롬프트 JSON 파싱 성공 - %s개 생성", len(prompts))
+            prompts = prompts[:num_images]
+            # 형식 검증까지 통과한 결과만 캐시 (기본 프롬프트는 캐시하지 않음)
+            _cache.set(cache_key, prompts)
+            return prompts
+        log.warning("프롬프트 형식이 올바르지 않아 기본 프롬프트 사용")
+    except json.JSONDecodeError as e:
+        log.warning("프롬프트 JSON 파싱 실패, 기본 프롬프트 사용: %s", e)
+
+    # 기본 프롬프트 생성
+    return [
+        {"title": f"제품 사용 장면 {i+1}", "description": f"{analysis['product_name']}을(를) 사용하는 모습"}
+        for i in range(num_images)
+    ]
+
+
+class _RateLimiter:
+    """
+    프로세스 전체의 API 요청 제한 (동시 요청 수 + 최근 60초 요청 수)
+    요청마다 별도 스레드의 이벤트 루프에서 실행되므로 asyncio가 아닌 threading으로 구현하고,
+    이벤트 루프를 막지 않도록 대기는 asyncio.sleep으로 처리
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, max_inflight, rpm):
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._rpm = rpm
+        self._sent = collections.deque()
+        self._lock = threading.Lock()
+
+    async def __aenter__(self):
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(self.POLL_INTERVAL)
+        try:
+            await self._wait_for_rate()
+        except BaseException:
+            self._slots.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._slots.release()
+
+    async def _wait_for_rate(self):
+        """최근 60초 동안 보낸 요청이 rpm개 미만이 될 때까지 대기"""
+        if not self._rpm:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= 60:
+                    self._sent.popleft()
+                if len(self._sent) < self._rpm:
+                    self._sent.append(now)
+                    return
+                delay = 60 - (now - self._sent[0])
+            log.debug("분당 요청 한도 도달, %.1f초 대기", delay)
+            await asyncio.sleep(delay)
+
+
+_image_limiter = _RateLimiter(IMAGE_GENERATION_MAX_INFLIGHT, IMAGE_GENERATION_RPM)
+
+
+@_api_retry
+async def _generate_one(client, semaphore, contents, config):
+    """
+    이미지 한 장 생성 요청
+    일시적 오류는 재시도하며, 대기 중에는 동시 요청 슬롯을 반납
+    요청 내 동시 요청 수(semaphore)와 프로세스 전체 제한(_image_limiter)을 모두 적용
+    """
+    async with semaphore, _image_limiter:
+        return await _on_client_loop(client.aio.models.generate_content(
+            model=GEMINI_MODEL,
+            contents=contents,
+            config=config
+        ))
 
 
-def generate_images_with_gemini(analysis, prompts, image_path):
+async def generate_images_with_gemini(analysis, prompts, image_path):
     """
     Gemini 2.5 Flash Image API를 사용하여 실제 이미지 생성
     통일된 응답 스키마: {"status":"ok|error", "type":"base64|url", "data":"..."}
+
+    프롬프트별 요청은 비동기 클라이언트로 동시에 보내며,
+    동시 요청 수는 IMAGE_GENERATION_CONCURRENCY로 제한합니다.
+    이미지 정보는 완료되는 순서대로 yield합니다.
     """
     if not GOOGLE_API_KEY:
         error_msg = "GOOGLE_API_KEY가 설정되지 않았습니다. .env 파일을 확인하세요."
-        print(f"[ERROR] {error_msg}")
+        log.error("%s", error_msg)
         raise ValueError(error_msg)
 
-    generated_images = []
-
-    # Gemini 클라이언트 초기화
+    # 공유 Gemini 클라이언트 사용
     try:
-        print(f"[INFO] Gemini 클라이언트 초기화 중...")
-        client = genai_client.Client(api_key=GOOGLE_API_KEY)
-        print(f"[INFO] Gemini 클라이언트 초기화 완료")
+        client = _get_client()
     except Exception as e:
         error_msg = f"Gemini 클라이언트를 초기화할 수 없습니다: {str(e)}"
-        print(f"[ERROR] {error_msg}")
-        import traceback
-        traceback.print_exc()
+        log.exception("%s", error_msg)
         raise ValueError(error_msg)
 
 
     # 원본 이미지 로드 (시각적 참조용)
-    print(f"[INFO] 원본 제품 이미지 로드: {image_path}")
-    original_product_image = Image.open(image_path)
-    print(f"[INFO] 원본 이미지 크기: {original_product_image.size}")
-    for idx, prompt_data in enumerate(prompts):
+    log.info("원본 제품 이미지 로드: %s", image_path)
+    original_product_image = _prepare_reference(image_path)
+    log.info("참조 이미지 크기: %s bytes", len(original_product_image.inline_data.data))
+
+    # 참조 이미지와 지시문을 컨텍스트 캐시에 한 번만 업로드
+    # 이미지 요청이 2개 이상일 때만 이득이므로 그보다 적으면 캐시 생성 왕복을 생략
+    global _context_cache_supported
+    preamble = "이 제품 이미지와 동일한 디자인을 유지하면서 다음 장면을 생성해주세요:"
+    cache = None
+    if IMAGE_CONTEXT_CACHE and _context_cache_supported and len(prompts) > 1:
         try:
-            # 이미지 생성
-            print(f"[INFO] 이미지 생성 중 ({idx+1}/{len(prompts)}): {prompt_data['title']}")
-            print(f"[DEBUG] 프롬프트: {prompt_data['description'][:100]}...")
-
-            # Gemini 2.5 Flash Image를 사용하여 이미지 생성
-            print(f"[DEBUG] API 호출 중 - 모델: gemini-2.5-flash-image")
-            response = client.models.generate_content(
-                model="gemini-2.5-flash-image",
-                contents=[
-                    "이 제품 이미지와 동일한 디자인을 유지하면서 다음 장면을 생성해주세요:",
-                    original_product_image,
-                    f"장면 설명: {prompt_data['description']}"
-                ],                config=types.GenerateContentConfig(
-                    response_modalities=["IMAGE"],
-                    image_config=types.ImageConfig(aspect_ratio="1:1")
+            cache = await _on_client_loop(client.aio.caches.create(
+                model=GEMINI_MODEL,
+                config=types.CreateCachedContentConfig(
+                    contents=[preamble, original_product_image],
+                    ttl=f"{IMAGE_CONTEXT_CACHE_TTL}s"
                 )
-            )
-            print(f"[DEBUG] API 응답 수신 완료")
+            ))
+            log.info("참조 이미지 캐시 생성 완료: %s", cache.name)
+        except genai_errors.ClientError as e:
+            # 모델이 캐시를 지원하지 않거나 최소 토큰 수에 미달하면 이후 요청에서도 같은 결과이므로
+            # 프로세스가 끝날 때까지 캐시 생성을 시도하지 않음 (요청 한도 초과는 일시적 오류로 취급)
+            if e.code != 429:
+                _context_cache_supported = False
+            log.warning("컨텍스트 캐시 생성 실패, 요청마다 이미지를 전송합니다: %s", e)
+        except Exception as e:
+            log.warning("컨텍스트 캐시 생성 실패, 요청마다 이미지를 전송합니다: %s", e)
+
+    # 모든 프롬프트에 공통인 요청 부분은 한 번만 구성
+    # 캐시가 있으면 참조 이미지를 재사용하고 장면 설명만 전송
+    prefix_parts = [] if cache else [preamble, original_product_image]
+    generate_config = types.GenerateContentConfig(
+        cached_content=cache.name if cache else None,
+        response_modalities=["IMAGE"],
+        image_config=types.ImageConfig(aspect_ratio="1:1")
+    )
+
+    semaphore = asyncio.Semaphore(IMAGE_GENERATION_CONCURRENCY)
+    # 생성 파일명 접두사 (요청마다 한 번만 만들고 이미지 번호를 붙임)
+    batch_id = uuid.uuid4().hex[:12]
+
+    async def _request(description, count):
+        # Gemini 2.5 Flash Image를 사용하여 이미지 생성 (count개면 후보 이미지 count개)
+        log.debug("API 호출 중 - 모델: %s", GEMINI_MODEL)
+        config = generate_config
+        if count > 1:
+            config = generate_config.model_copy(update={'candidate_count': count})
+        return await _generate_one(
+            client,
+            semaphore,
+            prefix_parts + [f"장면 설명: {description}"],
+            config
+        )
+
+    async def _one(idx, prompt_data, api_call, position):
+        try:
+            # 이미지 생성
+            log.info("이미지 생성 중 (%s/%s): %s", idx+1, len(prompts), prompt_data['title'])
+            log.debug("프롬프트: %.100s...", prompt_data['description'])
+
+            # 같은 요청으로 묶인 프롬프트는 응답을 공유하고 각자 자기 순서의 후보를 사용
+            response = await api_call
+            log.debug("API 응답 수신 완료 (%s/%s)", idx+1, len(prompts))
 
             # 생성된 이미지 처리
-            if response and response.candidates and len(response.candidates) > 0:
-                candidate = response.candidates[0]
+            if response and response.candidates and len(response.candidates) > position:
+                candidate = response.candidates[position]
 
                 # finish_reason 로깅
                 finish_reason = getattr(candidate, 'finish_reason', 'UNKNOWN')
-                print(f"[DEBUG] Finish reason: {finish_reason}")
+                log.debug("Finish reason: %s", finish_reason)
 
-                # Safety ratings 로깅
-                if hasattr(candidate, 'safety_ratings') and candidate.safety_ratings:
-                    print(f"[DEBUG] Safety ratings:")
+                # Safety ratings 로깅 (DEBUG가 꺼져 있으면 순회하지 않음)
+                if log.isEnabledFor(logging.DEBUG) and getattr(candidate, 'safety_ratings', None):
+                    log.debug("Safety ratings:")
                     for rating in candidate.safety_ratings:
-                        print(f"  - {rating.category}: {rating.probability}")
+                        log.debug("  - %s: %s", rating.category, rating.probability)
 
                 # content가 None인지 체크
                 if not candidate.content:
                     error_msg = f"콘텐츠가 생성되지 않았습니다. Finish reason: {finish_reason}"
-                    print(f"[WARNING] {error_msg}")
+                    log.warning("%s", error_msg)
 
                     # Safety filter로 차단되었는지 확인
                     if 'SAFETY' in str(finish_reason):
@@ -275,8 +735,7 @@ def generate_images_with_gemini(analysis, prompts, image_path):
                         "status": "error",
                         "message": error_msg
                     }
-                    generated_images.append(image_info)
-                    continue
+                    return image_info
 
                 # 이미지 데이터 추출
                 image_data = None
@@ -286,33 +745,52 @@ def generate_images_with_gemini(analysis, prompts, image_path):
                             image_data = part.inline_data.data
                             break
                 else:
-                    print(f"[WARNING] Content에 parts가 없습니다.")
+                    log.warning("Content에 parts가 없습니다.")
 
                 if image_data:
-                    # bytes를 base64로 인코딩
-                    if isinstance(image_data, bytes):
-                        # bytes인 경우 base64로 인코딩
-                        base64_image = base64.b64encode(image_data).decode('utf-8')
-                    else:
-                        # 이미 base64 문자열인 경우
-                        base64_image = image_data
-
-                    # data URI 형식으로 변환
-                    data_uri = f"data:image/png;base64,{base64_image}"
-
-                    print(f"✓ 이미지 생성 완료 ({idx+1}/{len(prompts)})")
+                    # 이미 base64 문자열인 경우 bytes로 디코딩
+                    if not isinstance(image_data, bytes):
+                        image_data = b64decode(image_data)
+
+                    # PIL로 열어보기 전에 시그니처로 이미지 데이터인지 확인
+                    image_kind = sniff_image_type(image_data[:32])
+                    if image_kind is None:
+                        log.warning("✗ 이미지 생성 실패: 응답 데이터가 이미지 형식이 아닙니다.")
+                        image_info = {
+                            "id": idx + 1,
+                            "title": prompt_data["title"],
+                            "prompt": prompt_data["description"],
+                            "status": "error",
+                            "message": "이미지 생성에 실패했습니다. (알 수 없는 이미지 형식)"
+                        }
+                        return image_info
+
+                    # 파일로 저장하여 URL로 제공 (base64 인라인 대비 전송량 33% 감소)
+                    # 인코딩과 디스크 쓰기는 스레드에서 처리하여 다른 이미지의 응답 처리를 막지 않음
+                    try:
+                        output_name = f"generated_{batch_id}_{idx+1}.webp"
+                        await asyncio.to_thread(_save_generated, image_data, image_kind, output_name)
+                        image_type = "url"
+                        image_src = f"/generated/{output_name}"
+                    except OSError as e:
+                        # 저장할 수 없는 환경에서는 data URI로 대체
+                        log.warning("생성 이미지 저장 실패, base64로 전달합니다: %s", e)
+                        image_type = "base64"
+                        image_src = f"data:image/{image_kind};base64,{b64encode_as_string(image_data)}"
+
+                    log.info("✓ 이미지 생성 완료 (%s/%s)", idx+1, len(prompts))
 
                     image_info = {
                         "id": idx + 1,
                         "title": prompt_data["title"],
                         "prompt": prompt_data["description"],
                         "status": "ok",
-                        "type": "base64",
-                        "data": data_uri
+                        "type": image_type,
+                        "data": image_src
                     }
-                    generated_images.append(image_info)
+                    return image_info
                 else:
-                    print(f"✗ 이미지 생성 실패: 응답에 이미지 데이터가 없습니다.")
+                    log.warning("✗ 이미지 생성 실패: 응답에 이미지 데이터가 없습니다.")
                     image_info = {
                         "id": idx + 1,
                         "title": prompt_data["title"],
@@ -320,9 +798,9 @@ def generate_images_with_gemini(analysis, prompts, image_path):
                         "status": "error",
                         "message": "이미지 생성에 실패했습니다. (이미지 데이터 없음)"
                     }
-                    generated_images.append(image_info)
+                    return image_info
             else:
-                print(f"✗ 이미지 생성 실패: 응답이 없습니다.")
+                log.warning("✗ 이미지 생성 실패: 응답이 없습니다.")
                 image_info = {
                     "id": idx + 1,
                     "title": prompt_data["title"],
@@ -330,17 +808,13 @@ def generate_images_with_gemini(analysis, prompts, image_path):
                     "status": "error",
                     "message": "이미지 생성에 실패했습니다. (응답 없음)"
                 }
-                generated_images.append(image_info)
+                return image_info
 
         except Exception as e:
             # 개별 이미지 생성 오류
             error_type = type(e).__name__
             error_msg = str(e)
-            print(f"[ERROR] 이미지 생성 오류 ({idx+1}/{len(prompts)})")
-            print(f"[ERROR] 오류 유형: {error_type}")
-            print(f"[ERROR] 오류 메시지: {error_msg}")
-            import traceback
-            traceback.print_exc()
+            log.exception("이미지 생성 오류 (%s/%s) - %s: %s", idx+1, len(prompts), error_type, error_msg)
 
             image_info = {
                 "id": idx + 1,
@@ -349,9 +823,161 @@ def generate_images_with_gemini(analysis, prompts, image_path):
                 "status": "error",
                 "message": f"{error_type}: {error_msg}"
             }
-            generated_images.append(image_info)
+            return image_info
 
-    return generated_images
+    # IMAGE_GENERATION_BATCH가 켜져 있으면 장면 설명이 같은 프롬프트를 묶어 한 번에 요청
+    batches = []
+    open_batches = {}
+    for idx, prompt_data in enumerate(prompts):
+        batch = open_batches.get(prompt_data['description']) if IMAGE_GENERATION_BATCH else None
+        if batch is None or len(batch) >= IMAGE_BATCH_MAX_SIZE:
+            batch = []
+            batches.append(batch)
+            open_batches[prompt_data['description']] = batch
+        batch.append((idx, prompt_data))
+    if len(batches) < len(prompts):
+        log.info("이미지 생성 요청 묶음: %s개 프롬프트 → %s회 요청", len(prompts), len(batches))
+
+    api_calls = []
+    tasks = []
+    for batch in batches:
+        api_call = asyncio.create_task(_request(batch[0][1]['description'], len(batch)))
+        api_calls.append(api_call)
+        tasks.extend(
+            asyncio.create_task(_one(idx, prompt_data, api_call, position))
+            for position, (idx, prompt_data) in enumerate(batch)
+        )
+    try:
+        # 완료되는 순서대로 전달 (클라이언트는 id로 순서를 맞춤)
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # 오류가 나거나 제너레이터가 닫히면 남은 요청을 취소하고 컨텍스트 캐시 삭제
+        # (작업 스레드에서 실행되므로 클라이언트 연결이 끊겨도 생성은 계속되어 다른 요청자에게 전달됨)
+        for task in tasks + api_calls:
+            task.cancel()
+        await asyncio.gather(*tasks, *api_calls, return_exceptions=True)
+
+        if cache:
+            try:
+                await _on_client_loop(client.aio.caches.delete(name=cache.name))
+                log.info("참조 이미지 캐시 삭제 완료: %s", cache.name)
+            except Exception as e:
+                log.warning("참조 이미지 캐시 삭제 실패: %s", e)
+
+
+class _GenerationJob:
+    """
+    진행 중인 이미지 생성 작업
+    생성된 NDJSON 줄을 모아 두고, 같은 작업을 요청한 모든 클라이언트에 전달
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.done = False
+        self._cond = threading.Condition()
+
+    def publish(self, payload):
+        with self._cond:
+            self.lines.append(orjson.dumps(payload) + b'\n')
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    def follow(self):
+        """처음부터 현재까지의 줄을 전달한 뒤 작업이 끝날 때까지 새 줄을 기다림"""
+        sent = 0
+        while True:
+            with self._cond:
+                while sent >= len(self.lines) and not self.done:
+                    self._cond.wait()
+                pending = self.lines[sent:]
+                if not pending:
+                    return
+            sent += len(pending)
+            yield from pending
+
+
+def _start_generation(key, analysis, num_images, filepath):
+    """
+    생성 작업을 등록하고 백그라운드에서 실행 (_inflight_lock을 잡은 상태에서 호출)
+    분석과 프롬프트 생성도 작업 안에서 실행하므로 동시에 들어온 같은 요청은 API 호출을 모두 공유
+    작업이 끝나면 _inflight에서 제거되어 다음 요청은 새로 생성함
+    """
+    job = _GenerationJob()
+    _inflight[key] = job
+    _generation_executor.submit(_run_generation, key, job, analysis, num_images, filepath)
+    return job
+
+
+async def _generation_stream(analysis, num_images, filepath):
+    """
+    분석 → 프롬프트 생성 → 이미지 생성 순서로 실행하며 NDJSON 줄을 yield
+    첫 줄은 분석 결과와 전체 개수, 이후 완료되는 순서대로 이미지 한 줄씩
+    """
+    # 이미지 분석 (/upload에서 받은 분석 결과를 함께 보내면 재사용)
+    if analysis is not None:
+        log.info("1단계: 요청에 포함된 분석 결과 사용")
+    else:
+        log.info("1단계: 이미지 분석 중...")
+        analysis = await analyze_product_image(filepath)
+    log.info("이미지 분석 완료 - 제품: %s", analysis.get('product_name', 'Unknown'))
+
+    # 프롬프트 생성 (참조 이미지 준비와 병렬 실행)
+    log.info("2단계: 프롬프트 생성 중...")
+    prompts, _ = await asyncio.gather(
+        generate_image_prompts(analysis, num_images),
+        asyncio.to_thread(_prepare_reference, filepath)
+    )
+    log.info("프롬프트 생성 완료 - %s개", len(prompts))
+
+    yield {
+        'success': True,
+        'analysis': analysis,
+        'total': len(prompts)
+    }
+
+    # 이미지 생성 (완료되는 이미지부터 한 줄씩)
+    log.info("3단계: AI 이미지 생성 중... (시간이 걸릴 수 있습니다)")
+    async for image_info in generate_images_with_gemini(analysis, prompts, filepath):
+        yield image_info
+
+
+def _run_generation(key, job, analysis, num_images, filepath):
+    """
+    분석부터 이미지 생성까지 실행하면서 결과를 작업에 한 줄씩 게시
+    끝나면 _inflight에서 제거 (작업 스레드에서 처리하므로 등록 중인 요청 스레드와 교착되지 않음)
+    """
+    total = 0
+    success_count = 0
+    try:
+        for payload in _iter_async(_generation_stream(analysis, num_images, filepath)):
+            if 'total' in payload:
+                total = payload['total']
+            elif payload.get('status') == 'ok':
+                success_count += 1
+            job.publish(payload)
+        log.info("이미지 생성 완료 - 성공: %s/%s", success_count, total)
+    except Exception as e:
+        # 응답 스트리밍이 이미 시작되어 상태 코드를 바꿀 수 없으므로 에러를 한 줄로 전달
+        if isinstance(e, ValueError):
+            error_msg = f'설정 오류: {str(e)}'
+        else:
+            error_msg = f'이미지 생성 중 오류 발생: {str(e)}'
+        log.exception("%s", error_msg)
+        job.publish({
+            'error': error_msg,
+            'error_type': type(e).__name__,
+            'error_details': str(e)
+        })
+    finally:
+        with _inflight_lock:
+            if _inflight.get(key) is job:
+                del _inflight[key]
+        job.finish()
 
 
 @app.route('/')
@@ -360,120 +986,183 @@ def index():
     return render_template('index.html')
 
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    """이미지 업로드 및 분석"""
-    if 'file' not in request.files:
-        return jsonify({'error': '파일이 없습니다.'}), 400
+def _upload_filename(upload_id, original_name, image_kind):
+    """
+    업로드 파일 저장 이름 (<ID>_<이름>.<실제 형식>)
+    한글 등으로만 된 이름은 secure_filename 후 확장자만 남으므로('한글.png' → 'png') 'upload'로 대체
+    """
+    safe_name = Path(secure_filename(original_name))
+    stem = safe_name.stem if safe_name.suffix or not Path(original_name).suffix else ''
+    return f"{upload_id}_{stem or 'upload'}.{image_kind}"
+
 
-    file = request.files['file']
+def _receive_upload(tmp_path):
+    """multipart 요청 본문을 스트리밍으로 파싱하여 'file' 필드를 바로 디스크에 기록
 
-    if file.filename == '':
-        return jsonify({'error': '파일이 선택되지 않았습니다.'}), 400
+    Werkzeug의 MultiPartParser와 SpooledTemporaryFile을 거치지 않음.
+    업로드된 원래 파일명을 반환하며, 'file' 필드가 없으면 None
+    """
+    parser = StreamingFormDataParser(headers=request.headers)
+    target = FileTarget(tmp_path, validator=MaxSizeValidator(app.config['MAX_CONTENT_LENGTH']))
+    parser.register('file', target)
+    while chunk := request.stream.read(UPLOAD_READ_CHUNK_SIZE):
+        parser.data_received(chunk)
+    return target.multipart_filename
 
-    if not allowed_file(file.filename):
-        return jsonify({'error': '허용되지 않는 파일 형식입니다.'}), 400
 
+@app.route('/upload', methods=['POST'])
+async def upload_file():
+    """이미지 업로드 및 분석"""
+    # 파일명을 알기 전에 임시 경로로 받은 뒤 검증이 끝나면 최종 이름으로 변경
+    # 같은 ID를 최종 파일명 접두사로 사용하여 동시에 올린 같은 이름의 파일도 겹치지 않음
+    upload_id = uuid.uuid4().hex[:12]
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f".{upload_id}.part")
     try:
+        try:
+            original_name = _receive_upload(tmp_path)
+        except ValidationError:
+            return _json_response({'error': '파일 크기가 너무 큽니다.'}, 413)
+        except ParseFailedException:
+            return _json_response({'error': '잘못된 업로드 요청입니다.'}, 400)
+
+        if original_name is None:
+            return _json_response({'error': '파일이 없습니다.'}, 400)
+        if original_name == '':
+            return _json_response({'error': '파일이 선택되지 않았습니다.'}, 400)
+
+        # 확장자 대신 실제 파일 내용으로 형식 확인
+        with open(tmp_path, 'rb') as fin:
+            head = fin.read(32)
+        image_kind = sniff_image_type(head)
+        if image_kind is None:
+            return _json_response({'error': '허용되지 않는 파일 형식입니다.'}, 400)
+
         # 파일 저장
-        filename = secure_filename(file.filename)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{filename}"
+        filename = _upload_filename(upload_id, original_name, image_kind)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        os.replace(tmp_path, filepath)
+    finally:
+        # 검증에 실패했거나 저장 중 오류가 나면 임시 파일 정리
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
 
+    try:
         # 이미지 분석
-        analysis = analyze_product_image(filepath)
+        analysis = await analyze_product_image(filepath)
 
-        return jsonify({
+        return _json_response({
             'success': True,
             'filename': filename,
             'analysis': analysis
         })
 
     except Exception as e:
-        return jsonify({'error': f'오류 발생: {str(e)}'}), 500
+        return _json_response({'error': f'오류 발생: {str(e)}'}, 500)
+
+
+@app.route('/analyze', methods=['POST'])
+async def analyze_image():
+    """
+    이미지 분석만 수행
+    요청 본문(multipart가 아닌 이미지 바이트 그대로)을 파일로 저장하지 않고 메모리에서 바로 분석
+    ?save=1이면 /upload와 같은 방식으로 저장하고 /generate에 사용할 파일명을 함께 반환
+    """
+    data = request.get_data(cache=False)
+    image_kind = sniff_image_type(data[:32])
+    if image_kind is None:
+        return _json_response({'error': '허용되지 않는 파일 형식입니다.'}, 400)
+
+    try:
+        result = {'success': True}
+        if request.args.get('save') == '1':
+            filename = _upload_filename(uuid.uuid4().hex[:12], 'upload', image_kind)
+            filepath = Path(app.config['UPLOAD_FOLDER']) / filename
+            await asyncio.to_thread(filepath.write_bytes, data)
+            result['filename'] = filename
+
+        result['analysis'] = await analyze_image_bytes(data)
+        return _json_response(result)
+
+    except Exception as e:
+        return _json_response({'error': f'오류 발생: {str(e)}'}, 500)
 
 
 @app.route('/generate', methods=['POST'])
 def generate_images():
-    """이미지 생성"""
+    """이미지 생성 (진행 상황을 NDJSON으로 스트리밍)"""
     data = request.json
     filename = data.get('filename')
     num_images = min(int(data.get('num_images', 10)), 10)
 
     if not filename:
         error_msg = '파일명이 필요합니다.'
-        print(f"[ERROR] {error_msg}")
-        return jsonify({'error': error_msg}), 400
-
-    try:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        print(f"[INFO] 이미지 생성 시작 - 파일: {filename}, 개수: {num_images}")
-
-        # 이미지 분석
-        print(f"[INFO] 1단계: 이미지 분석 중...")
-        analysis = analyze_product_image(filepath)
-        print(f"[INFO] 이미지 분석 완료 - 제품: {analysis.get('product_name', 'Unknown')}")
-
-        # 프롬프트 생성
-        print(f"[INFO] 2단계: 프롬프트 생성 중...")
-        prompts = generate_image_prompts(analysis, num_images)
-        print(f"[INFO] 프롬프트 생성 완료 - {len(prompts)}개")
-
-        # 이미지 생성
-        print(f"[INFO] 3단계: AI 이미지 생성 중... (시간이 걸릴 수 있습니다)")
-        generated = generate_images_with_gemini(analysis, prompts, filepath)
-        success_count = sum(1 for img in generated if img.get('status') == 'ok')
-        print(f"[INFO] 이미지 생성 완료 - 성공: {success_count}/{len(generated)}")
-
-        return jsonify({
-            'success': True,
-            'analysis': analysis,
-            'generated_images': generated
-        })
-
-    except ValueError as e:
-        error_msg = f'설정 오류: {str(e)}'
-        print(f"[ERROR] {error_msg}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': error_msg}), 500
-    except Exception as e:
-        error_msg = f'이미지 생성 중 오류 발생: {str(e)}'
-        print(f"[ERROR] {error_msg}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({
-            'error': error_msg,
-            'error_type': type(e).__name__,
-            'error_details': str(e)
-        }), 500
+        log.error("%s", error_msg)
+        return _json_response({'error': error_msg}, 400)
+
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.isfile(filepath):
+        error_msg = '업로드된 파일을 찾을 수 없습니다.'
+        log.error("%s: %s", error_msg, filename)
+        return _json_response({'error': error_msg}, 404)
+
+    # 같은 파일/개수로 진행 중인 작업이 있으면 새로 생성하지 않고 그 결과를 함께 받음
+    # API 호출 전에 등록하므로 거의 동시에 들어온 요청도 분석/프롬프트 생성부터 공유
+    key = (filename, num_images)
+    with _inflight_lock:
+        job = _inflight.get(key)
+        if job is None:
+            log.info("이미지 생성 시작 - 파일: %s, 개수: %s", filename, num_images)
+            job = _start_generation(key, _validate_analysis(data.get('analysis')), num_images, filepath)
+        else:
+            log.info("진행 중인 생성 작업에 합류 - 파일: %s, 개수: %s", filename, num_images)
+
+    return app.response_class(job.follow(), mimetype='application/x-ndjson')
+
+
+def _send_immutable(directory, filename):
+    """
+    파일명이 고유해 내용이 바뀌지 않는 파일을 장기 캐시 헤더와 함께 제공
+    브라우저는 재방문 시 다시 요청하지 않으며, 요청하더라도 ETag로 304 응답
+    """
+    response = send_from_directory(directory, filename, conditional=True, max_age=STATIC_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
     """업로드된 파일 제공"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return _send_immutable(app.config['UPLOAD_FOLDER'], filename)
 
 
 @app.route('/generated/<filename>')
 def generated_file(filename):
     """생성된 파일 제공"""
-    return send_from_directory(app.config['GENERATED_FOLDER'], filename)
+    return _send_immutable(app.config['GENERATED_FOLDER'], filename)
 
 
 @app.route('/health')
 def health():
     """헬스 체크"""
-    return jsonify({
+    return _json_response({
         'status': 'ok',
         'api_configured': bool(GOOGLE_API_KEY),
         'gemini_image_ready': bool(GOOGLE_API_KEY)
     })
 
 
+@app.errorhandler(413)
+def request_too_large(e):
+    """업로드 크기 초과 (MAX_CONTENT_LENGTH) 시 HTML 대신 JSON 오류 응답"""
+    max_mb = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    return _json_response({'error': f'파일 크기가 너무 큽니다. (최대 {max_mb}MB)'}, 413)
+
+
 if __name__ == '__main__':
-    # Railway는 PORT 환경 변수를 제공하므로 이를 사용
+    # 개발용 서버 (운영 환경은 gunicorn -c gunicorn_conf.py app:app)
+    # FLASK_DEV=1이면 디버그 모드(자동 재시작, 디버거)로 실행
     port = int(os.getenv('PORT', 5000))
-    app.run(debug=False, host='0.0.0.0', port=port)
+    app.run(debug=os.getenv('FLASK_DEV', '0') == '1', host='0.0.0.0', port=port)
@@ -0,0 +1,20 @@
+"""
+Gunicorn 설정
+실행: gunicorn -c gunicorn_conf.py app:app
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# /generate는 요청마다 asyncio 이벤트 루프를 실행하므로 gevent 대신 스레드 워커 사용
+# (gevent는 한 OS 스레드에서 여러 이벤트 루프를 동시에 돌릴 수 없음)
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+
+# 이미지 생성은 수 분까지 걸릴 수 있으므로 넉넉하게 설정
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 600))
+
+# 프록시/브라우저와의 연결을 요청 사이에 재사용
+keepalive = 5